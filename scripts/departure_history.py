@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Append-only columnar store of observed departures, for delay statistics over months of runs.
+
+Every run appends one row per scraped departure. Each column is its own fixed-width,
+little-endian file in history/, read back through a memory map, so a query only touches
+the columns it filters on:
+
+  sched.u32     scheduled departure, minutes since the Unix epoch
+  observed.u32  when the row was scraped, minutes since the Unix epoch
+  delay.i16     prognosis minus scheduled, minutes (0 without a prognosis)
+  line.u16      line id, see dictionary.json
+  stop.u16      stop id, see dictionary.json
+  hour.u8       local hour of the scheduled departure
+  flags.u8      bit 0: realtime prognosis
+
+index.json keeps, per block of BLOCK_ROWS rows, which lines and hours occur in it, so
+queries for a line or time of day skip the blocks that can't match.
+
+Usage:
+  python scripts/departure_history.py [--line B] [--stop "Danshøj St."] [--hour 8] [--by-hour]
+"""
+
+import argparse
+import json
+import mmap
+import statistics
+import sys
+from array import array
+from datetime import datetime, timedelta
+from pathlib import Path
+
+HISTORY_DIR = Path(__file__).parent.parent / 'history'
+BLOCK_ROWS = 4096
+
+# name: array typecode
+COLUMNS = {
+    'sched': 'I',
+    'observed': 'I',
+    'delay': 'h',
+    'line': 'H',
+    'stop': 'H',
+    'hour': 'B',
+    'flags': 'B'
+}
+FLAG_REALTIME = 1
+
+SUFFIXES = {'I': 'u32', 'h': 'i16', 'H': 'u16', 'B': 'u8'}
+
+
+def epoch_minutes(dt):
+    return int(dt.timestamp() // 60)
+
+
+def to_minutes(hhmm):
+    hours, minutes = map(int, hhmm.split(':'))
+    return hours * 60 + minutes
+
+
+def departure_times(departure, observed_at):
+    """Scheduled datetime and delay in minutes, rolling HH:MM over midnight when needed."""
+    scheduled = to_minutes(departure.get('scheduled') or departure['time'])
+    actual = to_minutes(departure['time'])
+
+    midnight = observed_at.replace(hour=0, minute=0, second=0, microsecond=0)
+    scheduled_at = midnight + timedelta(minutes=scheduled)
+    # Boards are requested a little ahead, so anything "12h ago" is really tomorrow
+    if scheduled_at < observed_at - timedelta(hours=12):
+        scheduled_at += timedelta(days=1)
+
+    delay = (actual - scheduled + 12 * 60) % (24 * 60) - 12 * 60
+    return scheduled_at, delay
+
+
+class DepartureHistory:
+    """The history/ directory: column files, id dictionary and block index."""
+
+    def __init__(self, path=HISTORY_DIR):
+        self.path = Path(path)
+        self.dictionary = self._load_json('dictionary.json', {'lines': [], 'stops': []})
+        self.index = self._load_json('index.json', {'block_rows': BLOCK_ROWS, 'blocks': []})
+
+    def _load_json(self, name, default):
+        file = self.path / name
+        if file.exists():
+            return json.loads(file.read_text(encoding='utf-8'))
+        return default
+
+    def _save_json(self, name, data):
+        with open(self.path / name, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+
+    def _column_file(self, name):
+        return self.path / f"{name}.{SUFFIXES[COLUMNS[name]]}"
+
+    def __len__(self):
+        """Rows present in every column (a run interrupted mid-append leaves ragged tails)."""
+        lengths = []
+        for name, typecode in COLUMNS.items():
+            file = self._column_file(name)
+            lengths.append(file.stat().st_size // array(typecode).itemsize if file.exists() else 0)
+        return min(lengths)
+
+    def _id(self, kind, value):
+        values = self.dictionary[kind]
+        if value not in values:
+            values.append(value)
+        return values.index(value)
+
+    def append(self, departures, observed_at=None):
+        """Append one row per departure; returns the number of rows written."""
+        observed_at = observed_at or datetime.now().astimezone()
+        rows = {name: array(typecode) for name, typecode in COLUMNS.items()}
+
+        for dep in departures:
+            try:
+                scheduled_at, delay = departure_times(dep, observed_at)
+            except (KeyError, ValueError):
+                continue
+            rows['sched'].append(epoch_minutes(scheduled_at))
+            rows['observed'].append(epoch_minutes(observed_at))
+            rows['delay'].append(max(-32768, min(32767, delay)))
+            rows['line'].append(self._id('lines', dep.get('line', '')))
+            rows['stop'].append(self._id('stops', dep.get('stop') or dep.get('url_source', '')))
+            rows['hour'].append(scheduled_at.hour)
+            rows['flags'].append(FLAG_REALTIME if dep.get('is_realtime') else 0)
+
+        count = len(rows['sched'])
+        if not count:
+            return 0
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        start = len(self)
+        for name, values in rows.items():
+            file = self._column_file(name)
+            if sys.byteorder != 'little':
+                # Swap a copy: the index below is built from the native values
+                values = array(values.typecode, values)
+                values.byteswap()
+            with open(file, 'ab') as f:
+                # Drop any ragged tail from an interrupted run before appending
+                f.truncate(start * values.itemsize)
+                values.tofile(f)
+
+        self._index_rows(start, rows['line'], rows['hour'])
+        self._save_json('dictionary.json', self.dictionary)
+        self._save_json('index.json', self.index)
+        return count
+
+    def _index_rows(self, start, lines, hours):
+        """Add the new rows to the per-block line and hour sets."""
+        blocks = self.index['blocks']
+        # Rebuilds after a ragged tail just overwrite the block the rows land in
+        del blocks[start // BLOCK_ROWS + 1:]
+        for offset, (line, hour) in enumerate(zip(lines, hours)):
+            block = (start + offset) // BLOCK_ROWS
+            while len(blocks) <= block:
+                blocks.append({'lines': [], 'hours': 0})
+            if line not in blocks[block]['lines']:
+                blocks[block]['lines'].append(line)
+            blocks[block]['hours'] |= 1 << hour
+
+    def _columns(self, names):
+        """Memory-mapped views of the requested columns, trimmed to the common length."""
+        rows = len(self)
+        views = {}
+        maps = []
+        for name in names:
+            typecode = COLUMNS[name]
+            if not rows:
+                views[name] = array(typecode)
+                continue
+            with open(self._column_file(name), 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            maps.append(mm)
+            view = memoryview(mm)[:rows * array(typecode).itemsize].cast(typecode)
+            if sys.byteorder != 'little':
+                view = array(typecode, view)
+                view.byteswap()
+            views[name] = view
+        return views, maps
+
+    def select(self, line=None, stop=None, hours=None, since=None):
+        """Row numbers matching the filters; blocks are skipped using the index."""
+        line_id = self.dictionary['lines'].index(line) if line in self.dictionary['lines'] else None
+        stop_id = self.dictionary['stops'].index(stop) if stop in self.dictionary['stops'] else None
+        if (line is not None and line_id is None) or (stop is not None and stop_id is None):
+            return []
+        hour_mask = sum(1 << hour for hour in hours) if hours is not None else None
+        since_minutes = epoch_minutes(since) if since else None
+
+        names = ['line', 'stop', 'hour', 'sched']
+        views, maps = self._columns(names)
+        try:
+            rows = len(views['line'])
+            selected = []
+            for block, info in enumerate(self.index['blocks']):
+                if line_id is not None and line_id not in info['lines']:
+                    continue
+                if hour_mask is not None and not info['hours'] & hour_mask:
+                    continue
+                for row in range(block * BLOCK_ROWS, min(rows, (block + 1) * BLOCK_ROWS)):
+                    if line_id is not None and views['line'][row] != line_id:
+                        continue
+                    if stop_id is not None and views['stop'][row] != stop_id:
+                        continue
+                    if hour_mask is not None and not hour_mask & (1 << views['hour'][row]):
+                        continue
+                    if since_minutes is not None and views['sched'][row] < since_minutes:
+                        continue
+                    selected.append(row)
+            return selected
+        finally:
+            for view in views.values():
+                if isinstance(view, memoryview):
+                    view.release()
+            for mm in maps:
+                mm.close()
+
+    def delay_stats(self, line=None, stop=None, hours=None, since=None):
+        """Delay statistics in minutes for departures matching the filters.
+
+        A departure is seen by several runs before it leaves; only its last observation
+        (the latest prognosis) counts.
+        """
+        rows = self.select(line, stop, hours, since)
+        views, maps = self._columns(['sched', 'line', 'stop', 'delay', 'flags'])
+        try:
+            latest = {}
+            for row in rows:
+                key = (views['sched'][row], views['line'][row], views['stop'][row])
+                latest[key] = (views['delay'][row], views['flags'][row] & FLAG_REALTIME)
+        finally:
+            for view in views.values():
+                if isinstance(view, memoryview):
+                    view.release()
+            for mm in maps:
+                mm.close()
+
+        delays = sorted(delay for delay, _ in latest.values())
+        if not delays:
+            return {'departures': 0, 'observations': len(rows)}
+        return {
+            'departures': len(delays),
+            'observations': len(rows),
+            'realtime': sum(realtime for _, realtime in latest.values()),
+            'mean': round(statistics.fmean(delays), 1),
+            'median': statistics.median(delays),
+            'p90': delays[min(len(delays) - 1, int(len(delays) * 0.9))],
+            'max': delays[-1],
+            'late': round(sum(1 for delay in delays if delay >= 3) / len(delays), 3)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delay statistics from history/')
+    parser.add_argument('--line', help='Line, e.g. B or 10')
+    parser.add_argument('--stop', help='Stop, e.g. "Danshøj St."')
+    parser.add_argument('--hour', type=int, action='append', help='Local hour of day (repeatable)')
+    parser.add_argument('--days', type=int, help='Only the last N days')
+    parser.add_argument('--by-hour', action='store_true', help='One line of statistics per hour of day')
+    args = parser.parse_args()
+
+    history = DepartureHistory()
+    since = datetime.now().astimezone() - timedelta(days=args.days) if args.days else None
+    print(f"{len(history)} observations, {len(history.dictionary['lines'])} lines, "
+          f"{len(history.dictionary['stops'])} stops")
+
+    hour_groups = [[hour] for hour in range(24)] if args.by_hour else [args.hour]
+    for hours in hour_groups:
+        stats = history.delay_stats(args.line, args.stop, hours, since)
+        if not stats['departures']:
+            continue
+        label = f"{hours[0]:02d}:00" if args.by_hour else 'all'
+        print(f"  {label}: {stats['departures']} departures, mean {stats['mean']} min, "
+              f"median {stats['median']}, p90 {stats['p90']}, max {stats['max']}, "
+              f"late (≥3 min) {stats['late']:.0%}")
+
+
+if __name__ == '__main__':
+    main()
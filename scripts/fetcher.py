@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Shared fetch layer for the trains, calendar and weather stages.
+
+- A per-run latency budget: FETCH_DEADLINE (unix time, set once per workflow run) or
+  FETCH_BUDGET_SECONDS from process start. No attempt or backoff sleep outlives it.
+- Retries with jittered exponential backoff for timeouts, connection errors, 429 and 5xx.
+- A per-host circuit breaker persisted in fetch-state.json, so a host that failed in
+  recent runs is skipped immediately and the stage falls back to its cached data.
+  Failures are counted once per host per run, however many fetches hit that host.
+"""
+
+import atexit
+import json
+import os
+import random
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+STATE_FILE = Path(__file__).parent.parent / 'fetch-state.json'
+
+DEFAULT_BUDGET_SECONDS = 60
+ATTEMPT_TIMEOUT = 10      # seconds, upper bound for a single attempt
+MIN_ATTEMPT_TIME = 1      # don't start an attempt with less budget than this
+BASE_DELAY = 0.5          # first backoff ceiling in seconds, doubled per attempt
+MAX_DELAY = 8
+MAX_ATTEMPTS = 4
+
+FAILURE_THRESHOLD = 3     # consecutive failed runs before a host's circuit opens
+OPEN_SECONDS = 30 * 60    # how long an open circuit skips the host before one trial call
+
+
+class FetchError(Exception):
+    """Raised when a fetch gave up: circuit open, budget spent or retries exhausted."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker per host, stored as JSON between runs."""
+
+    def __init__(self, state_file=STATE_FILE):
+        self.state_file = Path(state_file)
+        self.hosts = {}
+        self.changed = False
+        if self.state_file.exists():
+            try:
+                self.hosts = json.loads(self.state_file.read_text(encoding='utf-8')).get('hosts', {})
+            except (json.JSONDecodeError, AttributeError):
+                print(f"Warning: Could not parse {self.state_file.name}, resetting circuit breakers")
+
+    def allow(self, host):
+        """Closed, or open long enough that one trial call is allowed (half-open)."""
+        state = self.hosts.get(host)
+        if not state or state.get('opened_at') is None:
+            return True
+        return time.time() - state['opened_at'] >= OPEN_SECONDS
+
+    def record_success(self, host):
+        if host in self.hosts:
+            if self.hosts[host].get('opened_at') is not None:
+                print(f"  ✓ Circuit for {host} closed again")
+            del self.hosts[host]
+            self.changed = True
+
+    def record_failure(self, host, run):
+        """Count a failed run for the host; later failures in the same run don't add up."""
+        state = self.hosts.setdefault(host, {'failures': 0, 'opened_at': None, 'run': None})
+        if state.get('run') == run and state['opened_at'] is None:
+            return
+        if state.get('run') != run:
+            state['failures'] += 1
+            state['run'] = run
+        if state['failures'] >= FAILURE_THRESHOLD:
+            if state['opened_at'] is None:
+                print(f"  ✗ Circuit for {host} opened after {state['failures']} failures")
+            # A failed half-open trial re-opens the circuit for another full period
+            state['opened_at'] = int(time.time())
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        with open(self.state_file, 'w', encoding='utf-8') as f:
+            json.dump({'hosts': self.hosts}, f, indent=2, sort_keys=True)
+        self.changed = False
+
+
+def status_code(exc):
+    """HTTP status of a requests or googleapiclient error, if it has one."""
+    response = getattr(exc, 'response', None)
+    if response is not None and getattr(response, 'status_code', None):
+        return response.status_code
+    resp = getattr(exc, 'resp', None)
+    if resp is not None and getattr(resp, 'status', None):
+        return int(resp.status)
+    return None
+
+
+def is_retryable(exc):
+    """Timeouts and connection errors have no status; retry those, 429 and 5xx."""
+    # google.auth marks e.g. an invalid refresh token as not retryable. Its TransportError
+    # says retryable=False too, but wraps timeouts and connection resets, so only a
+    # RefreshError (checked by name, google.auth is only installed for the calendar) counts.
+    if getattr(exc, 'retryable', None) is False and any(cls.__name__ == 'RefreshError' for cls in type(exc).__mro__):
+        return False
+    status = status_code(exc)
+    return status is None or status == 429 or status >= 500
+
+
+class Fetcher:
+    """Runs upstream calls within the run's deadline, with retries and circuit breaking."""
+
+    def __init__(self, deadline=None, breaker=None):
+        if deadline is None:
+            if os.environ.get('FETCH_DEADLINE'):
+                deadline = float(os.environ['FETCH_DEADLINE'])
+            else:
+                deadline = time.time() + float(os.environ.get('FETCH_BUDGET_SECONDS', DEFAULT_BUDGET_SECONDS))
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker()
+
+    def remaining(self):
+        return self.deadline - time.time()
+
+    def call(self, host, fn):
+        """Call fn(timeout) with retries; fn gets the time allowed for this attempt."""
+        if not self.breaker.allow(host):
+            raise FetchError(f"circuit open for {host}, skipping")
+
+        last_error = None
+        for attempt in range(MAX_ATTEMPTS):
+            remaining = self.remaining()
+            if remaining < MIN_ATTEMPT_TIME:
+                break
+            try:
+                result = fn(min(ATTEMPT_TIMEOUT, remaining))
+            except Exception as e:
+                if not is_retryable(e):
+                    # The host answered, the request itself is wrong
+                    self.breaker.record_success(host)
+                    raise
+                last_error = e
+                delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+                if attempt + 1 < MAX_ATTEMPTS and self.remaining() - delay >= MIN_ATTEMPT_TIME:
+                    print(f"  Retrying {host} in {delay:.1f}s ({e})")
+                    time.sleep(delay)
+                    continue
+                break
+            self.breaker.record_success(host)
+            return result
+
+        if last_error is None:
+            # Not the host's fault, so the breaker isn't touched
+            raise FetchError(f"run budget spent before fetching {host}")
+        # The deadline identifies the run: shared by every stage via FETCH_DEADLINE
+        self.breaker.record_failure(host, self.deadline)
+        raise FetchError(f"{host} failed: {last_error}") from last_error
+
+    def get(self, url, **kwargs):
+        """requests.get through call(), raising for HTTP error statuses.
+
+        requests' timeout only bounds each connect/read, so a server trickling out its body
+        can hold a request far longer. The request runs in a daemon thread instead, and the
+        attempt is abandoned once its wall-clock time is up.
+        """
+        import requests
+
+        def attempt(timeout):
+            outcome = {}
+
+            def run():
+                try:
+                    response = requests.get(url, timeout=timeout, **kwargs)
+                    response.raise_for_status()
+                    outcome['response'] = response
+                except Exception as e:
+                    outcome['error'] = e
+
+            worker = threading.Thread(target=run, daemon=True)
+            worker.start()
+            worker.join(timeout)
+            if worker.is_alive():
+                raise requests.Timeout(f"no complete response within {timeout:.1f}s")
+            if 'error' in outcome:
+                raise outcome['error']
+            return outcome['response']
+
+        return self.call(urlsplit(url).hostname, attempt)
+
+    def save(self):
+        self.breaker.save()
+
+
+_fetcher = None
+
+
+def get_fetcher():
+    """The fetcher for this run; circuit state is written back when the process exits."""
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = Fetcher()
+        atexit.register(_fetcher.save)
+    return _fetcher
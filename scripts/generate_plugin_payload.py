@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Generate trmnl.json, a compact polling payload for a TRMNL private plugin.
+Holds only what the dashboard displays (trains, calendar days, weather) with short keys
+and raw UTF-8. A sequence number and per-section hashes let the plugin skip re-rendering
+when nothing changed.
+
+Schema (v1):
+  v    schema version
+  seq  bumped whenever any section hash changes
+  ts   generation time (local, minutes)
+  h    {"t": trains hash, "c": calendar hash, "w": weather hash}
+  t    [[line, time, destination, realtime(0/1)], ...]
+  c    [[date, weekday, label, [[time, title], ...]], ...]   time is "" for all-day
+  w    {"n": [temp, symbol, wind, high, low, rain], "r": [first hour, [rain x12]],
+        "d": [[day, high, low, symbol, rain], ...]}
+"""
+
+import hashlib
+import json
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+SCHEMA_VERSION = 1
+MAX_DEPARTURES = 8
+MAX_CALENDAR_UNITS = 18
+
+DANISH_MONTHS = ['Januar', 'Februar', 'Marts', 'April', 'Maj', 'Juni', 'Juli', 'Augusti',
+                 'September', 'Oktober', 'November', 'December']
+DANISH_DAYS = ['Mandag', 'Tirsdag', 'Onsdag', 'Torsdag', 'Fredag', 'Lørdag', 'Søndag']
+
+
+def read_js_data(path, var_name):
+    """Read the JSON object out of a "window.<var_name> = {...};" file."""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    content = path.read_text(encoding='utf-8')
+    prefix = f'window.{var_name} = '
+    if prefix not in content:
+        return {}
+    try:
+        return json.loads(content.replace(prefix, '').rstrip(';'))
+    except json.JSONDecodeError:
+        print(f"Warning: Could not parse {path.name}")
+        return {}
+
+
+def compact_trains(trains_data):
+    """Departures as [line, time, destination, realtime]."""
+    return [
+        [dep.get('line', ''), dep.get('time', ''), dep.get('destination', ''), int(bool(dep.get('is_realtime')))]
+        for dep in trains_data.get('departures', [])[:MAX_DEPARTURES]
+    ]
+
+
+def compact_calendar(calendar_data, now=None):
+    """Group upcoming events into days the same way the page does, within the same unit budget."""
+    now = now or datetime.now().astimezone()
+    today = now.date()
+
+    days = {}
+    for event in calendar_data.get('events', []):
+        if event.get('all_day'):
+            start = date.fromisoformat(event['start'][:10])
+            end = date.fromisoformat(event['end'][:10])  # exclusive
+            if end <= today:
+                continue
+            current = max(start, today)
+            while current < end:
+                days.setdefault(current, []).append(['', event['title'].strip()])
+                current += timedelta(days=1)
+        else:
+            start = datetime.fromisoformat(event['start']).astimezone(now.tzinfo)
+            if start < now:
+                continue
+            days.setdefault(start.date(), []).append([start.strftime('%H:%M'), event['title'].strip()])
+
+    compact = []
+    units = 0
+    for day in sorted(days):
+        # Need room for the date header plus at least one event
+        if units + 2 > MAX_CALENDAR_UNITS:
+            break
+        room = MAX_CALENDAR_UNITS - units - 1
+        events = days[day][:room]
+        label = f"{day.day} {DANISH_MONTHS[day.month - 1]}"
+        compact.append([day.isoformat(), DANISH_DAYS[day.weekday()], label, events])
+        units += 1 + len(events)
+    return compact
+
+
+def compact_weather(weather_data):
+    """Current conditions, 12h rain and the 3-day forecast as short arrays."""
+    if not weather_data.get('current'):
+        return {}
+    current = weather_data['current']
+    hourly = weather_data.get('hourly', [])
+    return {
+        'n': [current['temp'], current['symbol'], current['wind'], current['high'], current['low'], current['precip']],
+        'r': [hourly[0]['hour'] if hourly else '', [h['precip'] for h in hourly]],
+        'd': [[d['day'], d['high'], d['low'], d['symbol'], d['precip']] for d in weather_data.get('daily', [])]
+    }
+
+
+def section_hash(section):
+    """Short stable hash of a section's canonical JSON."""
+    canonical = json.dumps(section, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:8]
+
+
+def build_payload(trains_data, calendar_data, weather_data, previous=None, now=None):
+    """Assemble the payload, bumping seq only when a section hash changed."""
+    now = now or datetime.now().astimezone()
+    sections = {
+        't': compact_trains(trains_data),
+        'c': compact_calendar(calendar_data, now),
+        'w': compact_weather(weather_data)
+    }
+    hashes = {key: section_hash(value) for key, value in sections.items()}
+
+    previous = previous or {}
+    seq = previous.get('seq', 0)
+    if previous.get('v') != SCHEMA_VERSION or previous.get('h') != hashes:
+        seq += 1
+
+    return {
+        'v': SCHEMA_VERSION,
+        'seq': seq,
+        'ts': now.strftime('%Y-%m-%dT%H:%M'),
+        'h': hashes,
+        **sections
+    }
+
+
+def generate_plugin_payload():
+    """Write trmnl.json from trains-data.js, calendar-data.js and weather-data.js"""
+
+    script_dir = Path(__file__).parent.parent
+    output_file = script_dir / 'trmnl.json'
+
+    previous = {}
+    if output_file.exists():
+        try:
+            previous = json.loads(output_file.read_text(encoding='utf-8'))
+        except json.JSONDecodeError:
+            print("Warning: Could not parse previous trmnl.json, starting a new sequence")
+
+    payload = build_payload(
+        read_js_data(script_dir / 'trains-data.js', 'trainsData'),
+        read_js_data(script_dir / 'calendar-data.js', 'calendarData'),
+        read_js_data(script_dir / 'weather-data.js', 'weatherData'),
+        previous
+    )
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+
+    changed = [key for key, value in payload['h'].items() if previous.get('h', {}).get(key) != value]
+    print(f"✓ Generated trmnl.json (seq {payload['seq']}, {output_file.stat().st_size} bytes)")
+    print(f"  - Changed sections: {', '.join(changed) if changed else 'none'}")
+
+
+if __name__ == '__main__':
+    generate_plugin_payload()
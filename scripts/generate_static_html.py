@@ -8,47 +8,8 @@ import json
 import os
 from pathlib import Path
 
-def generate_static_html():
-    """Generate index.html with embedded data from trains-data.js and calendar-data.js"""
-    
-    script_dir = Path(__file__).parent.parent
-    
-    # Read the template HTML (NOT the generated index.html)
-    template_file = script_dir / 'index.template.html'
-    if not template_file.exists():
-        print("Error: index.template.html not found")
-        return
-    
-    with open(template_file, 'r', encoding='utf-8') as f:
-        html_content = f.read()
-    
-    # Read trains data
-    trains_data = {}
-    trains_file = script_dir / 'trains-data.js'
-    if trains_file.exists():
-        with open(trains_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-            # Extract JSON from "window.trainsData = {...};"
-            if 'window.trainsData = ' in content:
-                json_str = content.replace('window.trainsData = ', '').rstrip(';')
-                try:
-                    trains_data = json.loads(json_str)
-                except json.JSONDecodeError:
-                    print("Warning: Could not parse trains-data.js")
-    
-    # Read calendar data
-    calendar_data = {}
-    calendar_file = script_dir / 'calendar-data.js'
-    if calendar_file.exists():
-        with open(calendar_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-            # Extract JSON from "window.calendarData = {...};"
-            if 'window.calendarData = ' in content:
-                json_str = content.replace('window.calendarData = ', '').rstrip(';')
-                try:
-                    calendar_data = json.loads(json_str)
-                except json.JSONDecodeError:
-                    print("Warning: Could not parse calendar-data.js")
+def embed_data(html_content, trains_data, calendar_data):
+    """Replace the template placeholder with the given data and stamp the generation time."""
     
     # Find the placeholder and replace it with embedded data
     old_placeholder = '''    <script>
@@ -96,6 +57,53 @@ def generate_static_html():
     cache_bust_comment = f'<!-- Generated: {timestamp} -->\n'
     html_content = html_content.replace('<!DOCTYPE html>', f'<!DOCTYPE html>\n{cache_bust_comment}', 1)
     
+    return html_content
+
+
+def generate_static_html():
+    """Generate index.html with embedded data from trains-data.js and calendar-data.js"""
+    
+    script_dir = Path(__file__).parent.parent
+    
+    # Read the template HTML (NOT the generated index.html)
+    template_file = script_dir / 'index.template.html'
+    if not template_file.exists():
+        print("Error: index.template.html not found")
+        return
+    
+    with open(template_file, 'r', encoding='utf-8') as f:
+        html_content = f.read()
+    
+    # Read trains data
+    trains_data = {}
+    trains_file = script_dir / 'trains-data.js'
+    if trains_file.exists():
+        with open(trains_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+            # Extract JSON from "window.trainsData = {...};"
+            if 'window.trainsData = ' in content:
+                json_str = content.replace('window.trainsData = ', '').rstrip(';')
+                try:
+                    trains_data = json.loads(json_str)
+                except json.JSONDecodeError:
+                    print("Warning: Could not parse trains-data.js")
+    
+    # Read calendar data
+    calendar_data = {}
+    calendar_file = script_dir / 'calendar-data.js'
+    if calendar_file.exists():
+        with open(calendar_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+            # Extract JSON from "window.calendarData = {...};"
+            if 'window.calendarData = ' in content:
+                json_str = content.replace('window.calendarData = ', '').rstrip(';')
+                try:
+                    calendar_data = json.loads(json_str)
+                except json.JSONDecodeError:
+                    print("Warning: Could not parse calendar-data.js")
+    
+    html_content = embed_data(html_content, trains_data, calendar_data)
+    
     # Write the generated HTML
     output_file = script_dir / 'index.html'
     with open(output_file, 'w', encoding='utf-8') as f:
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Render dashboards for several TRMNL devices (tenants) from one config file.
+Upstream data is fetched once per distinct station board, weather grid cell and calendar,
+then each tenant's index.html and trmnl.json are rendered in a process pool.
+
+With REUSE_RUN_OUTPUTS=1 (set by the workflows, which run the single-home stages first) the
+default boards, Copenhagen's grid cell and the calendars in calendar.json are taken from
+this run's trains-data.js, weather-data.js and calendar.json instead of being fetched again.
+
+Usage:
+  python scripts/render_tenants.py [tenants.json]
+
+Output goes to tenants/<id>/index.html and tenants/<id>/trmnl.json; the layout reports of
+boards fetched here go to tenants/layouts.json.
+See tenants.example.json for the config format.
+"""
+
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from generate_plugin_payload import build_payload, read_js_data
+from generate_static_html import embed_data
+from update_trains import (
+    BOARDS, TRAINS_FILE, board_key, cached_departures, check_layout, combine_departures, fetch_board,
+    mock_departures, target_time
+)
+from update_weather import COPENHAGEN_LAT, COPENHAGEN_LON, fetch_weather, grid_key
+
+ROOT_DIR = Path(__file__).parent.parent
+WEATHER_FILE = ROOT_DIR / 'weather-data.js'
+CALENDAR_FILE = ROOT_DIR / 'calendar.json'
+# Layout reports of boards fetched here (tenant-only boards), for schema drift detection
+LAYOUTS_FILE = ROOT_DIR / 'tenants' / 'layouts.json'
+
+
+def tenant_problem(tenant):
+    """What's wrong with a tenant entry, or None if it can be rendered."""
+    if not isinstance(tenant, dict):
+        return 'not an object'
+    if not isinstance(tenant.get('id'), str) or not re.fullmatch(r'[A-Za-z0-9_-]+', tenant['id']):
+        return 'id must be letters, digits, - or _'
+    for field in ('lat', 'lon'):
+        if field in tenant and (isinstance(tenant[field], bool) or not isinstance(tenant[field], (int, float))):
+            return f"{field} must be a number"
+    boards = tenant.get('boards', BOARDS)
+    if not isinstance(boards, list):
+        return 'boards must be a list'
+    for board in boards:
+        if not isinstance(board, dict) or not all(isinstance(board.get(key), str) for key in ('label', 'input')):
+            return f"board needs a label and an input: {board}"
+        if not isinstance(board.get('direction', ''), str):
+            return f"board direction must be a string: {board}"
+    calendars = tenant.get('calendars', [])
+    if not isinstance(calendars, list) or not all(isinstance(name, str) for name in calendars):
+        return 'calendars must be a list of IDs or names'
+    return None
+
+
+def load_tenants(config_file):
+    """Read the tenant list, filling in the single-home defaults for missing fields."""
+    with open(config_file, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    tenants = []
+    for tenant in config.get('tenants', []):
+        problem = tenant_problem(tenant)
+        if problem:
+            print(f"  Warning: tenant skipped ({problem}): {tenant}")
+            continue
+        tenants.append({
+            'id': tenant['id'],
+            'name': tenant.get('name', 'Copenhagen'),
+            'lat': tenant.get('lat', COPENHAGEN_LAT),
+            'lon': tenant.get('lon', COPENHAGEN_LON),
+            'station': tenant.get('station', ' / '.join(b['label'] for b in tenant.get('boards', BOARDS))),
+            'boards': tenant.get('boards', BOARDS),
+            'calendars': tenant.get('calendars', [])
+        })
+    return tenants
+
+
+def reuse_run_outputs():
+    return os.environ.get('REUSE_RUN_OUTPUTS') == '1'
+
+
+def fetch_boards(tenants):
+    """Fetch every distinct station board once; a failed board keeps its cached departures."""
+    boards = {}
+    for tenant in tenants:
+        for board in tenant['boards']:
+            boards.setdefault(board_key(board), board)
+
+    trains_data = read_js_data(TRAINS_FILE, 'trainsData')
+    results = {}
+    if reuse_run_outputs():
+        # update_trains.py already fetched (or fell back for) the default boards this run and
+        # saved each board's full list; the combined departures are cut to the nearest 8
+        board_lists = trains_data.get('boards', {})
+        for board in BOARDS:
+            key = board_key(board)
+            if key in boards and board['label'] in board_lists:
+                results[key] = board_lists[board['label']]
+                del boards[key]
+        if results:
+            print(f"\nReusing {len(results)} station board(s) from {TRAINS_FILE.name}")
+    if not boards:
+        return results
+
+    print(f"\n=== Fetching {len(boards)} station board(s) ===")
+    target_dt = target_time()
+    layouts = read_layouts()
+    for key, board in boards.items():
+        # Keyed by station and direction: tenants may reuse a label for different stations
+        layout_key = ' → '.join(part for part in key if part)
+        try:
+            print(f"Fetching {board['label']}...")
+            results[key], report = fetch_board(board, target_dt)
+            previous = layouts.get(layout_key) or trains_data.get('layouts', {}).get(board['label'], {})
+            check_layout(board['label'], report, {board['label']: previous})
+            layouts[layout_key] = report
+        except Exception as e:
+            print(f"  ✗ {board['label']} failed: {e}")
+            results[key] = cached_departures(board['label'])
+    save_layouts(layouts)
+    return results
+
+
+def read_layouts():
+    """Saved layout reports by station (and direction), {} if there are none yet."""
+    try:
+        return json.loads(LAYOUTS_FILE.read_text(encoding='utf-8'))
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_layouts(layouts):
+    """Keep this run's reports for the next run's drift check; failed boards keep their old one."""
+    LAYOUTS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(LAYOUTS_FILE, 'w', encoding='utf-8') as f:
+        json.dump(layouts, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+def fetch_weather_cells(tenants):
+    """Fetch the forecast once per weather grid cell."""
+    cells = {grid_key(tenant['lat'], tenant['lon']) for tenant in tenants}
+
+    results = {}
+    home = grid_key(COPENHAGEN_LAT, COPENHAGEN_LON)
+    if reuse_run_outputs() and home in cells:
+        weather = read_js_data(WEATHER_FILE, 'weatherData')
+        if weather.get('current'):
+            print(f"\nReusing the forecast for {home[0]}, {home[1]} from {WEATHER_FILE.name}")
+            results[home] = weather
+            cells.discard(home)
+    if not cells:
+        return results
+
+    print(f"\n=== Fetching {len(cells)} weather grid cell(s) ===")
+    for lat, lon in cells:
+        try:
+            print(f"Fetching forecast for {lat}, {lon}...")
+            results[(lat, lon)] = fetch_weather(lat, lon)
+        except Exception as e:
+            print(f"  ✗ Forecast for {lat}, {lon} failed: {e}")
+            results[(lat, lon)] = {}
+    return results
+
+
+def fetch_calendars(tenants):
+    """Fetch every calendar any tenant uses in one batch request, keyed by the tenant's selector.
+
+    A calendar without fetched events (None) is filled in from calendar.json when merging.
+    """
+    wanted = []
+    for tenant in tenants:
+        for name in tenant['calendars']:
+            if name not in wanted:
+                wanted.append(name)
+    if not wanted:
+        return {}, {}
+
+    from update_calendar import (
+        execute, fetch_events_batched, get_service, read_calendar_file, select_calendars, time_range
+    )
+
+    # The calendars update_calendar.py wrote this run, and the selectors that resolve to them
+    known = read_calendar_file(CALENDAR_FILE).get('calendars', []) if reuse_run_outputs() else []
+    reused = {}
+    for name in wanted:
+        match = [cal for cal in known if name in (cal['id'], cal['summary']) or (name == 'primary' and cal['primary'])]
+        if match:
+            reused[name] = match[:1]
+    if len(reused) == len(wanted):
+        print(f"\nReusing {len(wanted)} calendar(s) from {CALENDAR_FILE.name}")
+        return reused, {}
+
+    if not os.environ.get('GOOGLE_CALENDAR_REFRESH_TOKEN'):
+        print("\nWarning: GOOGLE_CALENDAR_REFRESH_TOKEN not set, rendering without calendars")
+        return reused, {}
+
+    print(f"\n=== Fetching calendars ===")
+    try:
+        service = get_service()
+        calendar_list = execute(service.calendarList().list())
+        available = calendar_list.get('items', [])
+        selected = {name: select_calendars(available, [name]) for name in wanted}
+
+        unique = []
+        for cals in selected.values():
+            for cal in cals:
+                if cal not in unique:
+                    unique.append(cal)
+
+        time_min, time_max = time_range(datetime.utcnow())
+        events = fetch_events_batched(service, unique, time_min, time_max)
+        print(f"✓ Fetched {len(unique)} calendar(s) in one batch")
+        return selected, {cal['id']: cal_events for cal, cal_events in zip(unique, events)}
+    except Exception as e:
+        print(f"✗ Error fetching calendars: {e}")
+        return reused, {}
+
+
+def render_tenant(job):
+    """Render one tenant's index.html and trmnl.json (runs in a worker process)."""
+    tenant = job['tenant']
+    output_dir = Path(job['output_dir'])
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Point the page's own weather fetch and heading at this tenant's location
+    html_content = job['template']
+    html_content = html_content.replace(f'const COPENHAGEN_LAT = {COPENHAGEN_LAT};', f"const COPENHAGEN_LAT = {tenant['lat']};")
+    html_content = html_content.replace(f'const COPENHAGEN_LON = {COPENHAGEN_LON};', f"const COPENHAGEN_LON = {tenant['lon']};")
+    html_content = html_content.replace('Today in Copenhagen', f"Today in {tenant['name']}")
+    html_content = embed_data(html_content, dict(job['trains_data']), dict(job['calendar_data']))
+
+    with open(output_dir / 'index.html', 'w', encoding='utf-8') as f:
+        f.write(html_content)
+
+    payload_file = output_dir / 'trmnl.json'
+    previous = {}
+    if payload_file.exists():
+        try:
+            previous = json.loads(payload_file.read_text(encoding='utf-8'))
+        except json.JSONDecodeError:
+            pass
+
+    payload = build_payload(job['trains_data'], job['calendar_data'], job['weather_data'], previous)
+    with open(payload_file, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+
+    return tenant['id'], payload['seq'], len(job['trains_data']['departures']), len(job['calendar_data']['events'])
+
+
+def build_job(tenant, template, updated, board_results, weather_results, selected_calendars, calendar_events):
+    """Everything a worker needs to render one tenant, from the shared upstream data."""
+    departures = []
+    for board in tenant['boards']:
+        departures.extend(board_results[board_key(board)])
+    if not departures:
+        print(f"  Warning: no departures for {tenant['id']}, using mock data")
+        departures = mock_departures()
+
+    calendars = []
+    for name in tenant['calendars']:
+        for cal in selected_calendars.get(name, []):
+            if cal not in calendars:
+                calendars.append(cal)
+    events = []
+    if calendars:
+        from update_calendar import cached_events, merge_events
+        # Calendars whose request failed keep their events from the last calendar.json
+        events = merge_events(calendars, [calendar_events.get(cal['id']) for cal in calendars],
+                              cached_events(CALENDAR_FILE))
+
+    return {
+        'tenant': tenant,
+        'template': template,
+        'output_dir': str(ROOT_DIR / 'tenants' / tenant['id']),
+        'trains_data': {'updated': updated, 'station': tenant['station'], 'departures': combine_departures(departures)},
+        'calendar_data': {'updated': updated, 'events': events},
+        'weather_data': weather_results[grid_key(tenant['lat'], tenant['lon'])]
+    }
+
+def render_tenants(config_file):
+    """Fetch shared upstream data once, then render every tenant in a process pool."""
+    tenants = load_tenants(config_file)
+    if not tenants:
+        print(f"Error: no tenants in {config_file}")
+        return
+
+    template_file = ROOT_DIR / 'index.template.html'
+    if not template_file.exists():
+        print("Error: index.template.html not found")
+        return
+    template = template_file.read_text(encoding='utf-8')
+
+    board_results = fetch_boards(tenants)
+    weather_results = fetch_weather_cells(tenants)
+    selected_calendars, calendar_events = fetch_calendars(tenants)
+
+    updated = datetime.now().isoformat()
+    jobs = []
+    for tenant in tenants:
+        try:
+            jobs.append(build_job(tenant, template, updated, board_results, weather_results,
+                                  selected_calendars, calendar_events))
+        except Exception as e:
+            print(f"  ✗ {tenant['id']} skipped: {e}")
+
+    # One tenant failing must not cost the others their update
+    print(f"\n=== Rendering {len(jobs)} tenant(s) ===")
+    failed = 0
+    with ProcessPoolExecutor() as executor:
+        futures = [(job['tenant']['id'], executor.submit(render_tenant, job)) for job in jobs]
+        for tenant_id, future in futures:
+            try:
+                tenant_id, seq, n_departures, n_events = future.result()
+            except Exception as e:
+                print(f"✗ {tenant_id} failed: {e}")
+                failed += 1
+                continue
+            print(f"✓ {tenant_id}: {n_departures} departures, {n_events} events (seq {seq})")
+    failed += len(tenants) - len(jobs)
+    if failed:
+        print(f"::warning title=Tenant dashboards::{failed} of {len(tenants)} tenant(s) not rendered")
+
+
+if __name__ == '__main__':
+    render_tenants(sys.argv[1] if len(sys.argv) > 1 else ROOT_DIR / 'tenants.json')
@@ -2,156 +2,344 @@
 """
 Fetch Google Calendar events and save to JSON file.
 Uses OAuth 2.0 user credentials instead of service accounts.
+Several calendars can be selected with GOOGLE_CALENDAR_IDS; they are fetched in one
+batch request and merged by start time.
 """
 
+import heapq
 import json
 import os
 from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import httplib2
 from google.oauth2.credentials import Credentials
+from functools import partial
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 
+from fetcher import ATTEMPT_TIMEOUT, FetchError, get_fetcher, is_retryable
+
 # Get the refresh token from environment
 REFRESH_TOKEN = os.environ.get('GOOGLE_CALENDAR_REFRESH_TOKEN')
 CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
 CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
 
-if not REFRESH_TOKEN:
-    print("Error: GOOGLE_CALENDAR_REFRESH_TOKEN environment variable not set")
-    print("Run: python3 scripts/get_oauth_token.py")
-    exit(1)
-
-if not CLIENT_ID or not CLIENT_SECRET:
-    print("Error: GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET environment variables not set")
-    print("These should be set as GitHub Secrets or environment variables")
-    exit(1)
-
-try:
-    # Create credentials from refresh token
-    creds = Credentials(
-        token=None,
-        refresh_token=REFRESH_TOKEN,
-        token_uri='https://oauth2.googleapis.com/token',
-        client_id=CLIENT_ID,
-        client_secret=CLIENT_SECRET
-    )
-    
-    # Refresh to get a valid access token
-    creds.refresh(Request())
-    print(f"✓ Successfully authenticated with Google Calendar")
+# Zone all-day events start in, for merging calendars by start time
+CALENDAR_TZ = ZoneInfo('Europe/Copenhagen')
+
+GOOGLE_TOKEN_HOST = 'oauth2.googleapis.com'
+GOOGLE_API_HOST = 'www.googleapis.com'
+
+# Optional comma-separated calendar IDs or names (e.g. "primary,Familie,Helligdage")
+CALENDAR_IDS = [c.strip() for c in os.environ.get('GOOGLE_CALENDAR_IDS', '').split(',') if c.strip()]
+
+CALENDAR_FILE = 'calendar.json'
+
+
+class CalendarError(Exception):
+    """Missing or rejected credentials; main() exits, other callers render without calendars."""
+
+
+def select_calendars(calendars, wanted):
+    """Pick calendars by ID or name; with no selection use the primary (or first) calendar."""
+    if not wanted:
+        for cal in calendars:
+            if cal.get('primary', False):
+                return [cal]
+        return calendars[:1]
+
+    selected = []
+    for name in wanted:
+        match = None
+        for cal in calendars:
+            if name == cal['id'] or name == cal.get('summary') or (name == 'primary' and cal.get('primary', False)):
+                match = cal
+                break
+        if match is None:
+            print(f"  Warning: calendar '{name}' not found, skipping")
+        elif match not in selected:
+            selected.append(match)
+    return selected
+
+
+def event_sort_key(event):
+    """Sort key for a processed event; all-day events sort at midnight in CALENDAR_TZ.
     
-except Exception as e:
-    print(f"Error authenticating: {e}")
-    print("Make sure GOOGLE_CALENDAR_REFRESH_TOKEN is set correctly")
-    exit(1)
-
-# Create the Calendar API client
-service = build('calendar', 'v3', credentials=creds)
-
-# Try to get calendar list to see what calendars are accessible
-print("\n=== Available calendars ===")
-try:
-    calendar_list = service.calendarList().list().execute()
-    calendars = calendar_list.get('items', [])
+    Google orders startTime in the calendar's zone, so date-only starts must not depend
+    on the runner's local zone or a calendar's stream stops being monotonic.
+    """
+    start = datetime.fromisoformat(event['start'])
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=CALENDAR_TZ)
+    return start.timestamp()
+
+
+def timed_http(http, timeout):
+    """A fresh authorized connection whose socket timeout is the attempt's time."""
+    return AuthorizedHttp(http.credentials, http=httplib2.Http(timeout=timeout))
+
+
+def execute(request):
+    """Run an API request through the fetcher, each attempt bounded by its timeout."""
+    return get_fetcher().call(GOOGLE_API_HOST, lambda timeout: request.execute(http=timed_http(request.http, timeout)))
+
+
+def fetch_events_batched(service, calendars, time_min, time_max):
+    """Fetch events for all calendars in one batch HTTP request, returning per-calendar lists.
+
+    Sub-requests that fail with 429 or 5xx are retried in a new batch. A calendar that
+    still failed gets None instead of a list; FetchError if every calendar failed.
+    """
+    results = {}
+    errors = {}
+
+    def handle_response(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = exception
+        else:
+            errors.pop(request_id, None)
+            results[request_id] = response.get('items', [])
+
+    def attempt(timeout):
+        # Only calendars without an answer yet, or with a retryable error
+        pending = [
+            cal for cal in calendars
+            if cal['id'] not in results and (cal['id'] not in errors or is_retryable(errors[cal['id']]))
+        ]
+        if not pending:
+            return
+        batch = service.new_batch_http_request(callback=handle_response)
+        requests = []
+        for cal in pending:
+            request = service.events().list(
+                calendarId=cal['id'],
+                timeMin=time_min,
+                timeMax=time_max,
+                singleEvents=True,
+                orderBy='startTime',
+                maxResults=50
+            )
+            requests.append(request)
+            batch.add(request, request_id=cal['id'])
+        batch.execute(http=timed_http(requests[0].http, timeout))
+
+        retryable = [errors[cal['id']] for cal in pending if cal['id'] in errors and is_retryable(errors[cal['id']])]
+        if retryable:
+            raise retryable[0]
+
+    try:
+        get_fetcher().call(GOOGLE_API_HOST, attempt)
+    except FetchError:
+        if not results:
+            raise
+
+    for cal_id, exception in errors.items():
+        print(f"  ✗ {cal_id} failed: {exception}")
+    if calendars and not results:
+        raise FetchError("All calendar requests in the batch failed")
+
+    return [results.get(cal['id']) for cal in calendars]
+
+
+def process_event(event, calendar_name):
+    """Reduce an API event to the fields the page uses, tagged with its calendar."""
+    start = event['start'].get('dateTime') or event['start'].get('date')
+    end = event['end'].get('dateTime') or event['end'].get('date')
+
+    return {
+        'title': event.get('summary', 'Untitled'),
+        'start': start,
+        'end': end,
+        'description': event.get('description', ''),
+        'location': event.get('location', ''),
+        'all_day': 'dateTime' not in event['start'],
+        'calendar': calendar_name
+    }
+
+
+def read_calendar_file(calendar_file=CALENDAR_FILE):
+    """The last good calendar.json, or {} if there is none."""
+    try:
+        with open(calendar_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def cached_events(calendar_file=CALENDAR_FILE):
+    """Processed events from the last good calendar.json, in start-time order."""
+    return read_calendar_file(calendar_file).get('events', [])
+
+
+def merge_events(calendars, events_per_calendar, cached=None):
+    """Merge the already start-time sorted per-calendar lists into one feed.
+
+    A calendar whose list is None (its request failed) keeps its events from cached.
+    """
+    streams = []
+    for cal, events in zip(calendars, events_per_calendar):
+        name = cal.get('summary', cal['id'])
+        if events is None:
+            kept = [event for event in cached or [] if event.get('calendar') == name]
+            print(f"  Keeping {len(kept)} cached events for {name}")
+            streams.append(kept)
+        else:
+            streams.append([process_event(event, name) for event in events])
+    return list(heapq.merge(*streams, key=event_sort_key))
+
+
+def get_service():
+    """Authenticate with the refresh token and build the Calendar API client."""
+    if not REFRESH_TOKEN:
+        raise CalendarError("GOOGLE_CALENDAR_REFRESH_TOKEN environment variable not set\n"
+                            "Run: python3 scripts/get_oauth_token.py")
     
-    if not calendars:
-        print("ERROR: No calendars found!")
-        print("This usually means the GOOGLE_CALENDAR_REFRESH_TOKEN is invalid or expired.")
-        print("Run: python3 scripts/get_oauth_token.py")
-        # Create empty calendar.json and exit
-        with open('calendar.json', 'w') as f:
-            json.dump({'updated': datetime.utcnow().isoformat(), 'events': []}, f)
-        exit(1)
-    else:
-        for i, cal in enumerate(calendars):
-            print(f"{i+1}. {cal.get('summary', 'Unnamed')} ({cal['id']})")
-            print(f"   Primary: {cal.get('primary', False)}")
+    if not CLIENT_ID or not CLIENT_SECRET:
+        raise CalendarError("GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET environment variables not set\n"
+                            "These should be set as GitHub Secrets or environment variables")
     
-    # Use the primary calendar (your main calendar)
-    primary_cal = None
-    for cal in calendars:
-        if cal.get('primary', False):
-            primary_cal = cal
-            break
+    try:
+        # Create credentials from refresh token
+        creds = Credentials(
+            token=None,
+            refresh_token=REFRESH_TOKEN,
+            token_uri='https://oauth2.googleapis.com/token',
+            client_id=CLIENT_ID,
+            client_secret=CLIENT_SECRET
+        )
+        
+        # Refresh to get a valid access token (google-auth waits up to 120s by default)
+        get_fetcher().call(GOOGLE_TOKEN_HOST, lambda timeout: creds.refresh(partial(Request(), timeout=timeout)))
+        print(f"✓ Successfully authenticated with Google Calendar")
+        
+    except FetchError:
+        raise
+    except Exception as e:
+        if is_retryable(e):
+            # The token host is slow or unreachable, not the credentials: keep the cache
+            raise FetchError(f"{GOOGLE_TOKEN_HOST} failed: {e}") from e
+        raise CalendarError(f"authenticating failed: {e}\n"
+                            "Make sure GOOGLE_CALENDAR_REFRESH_TOKEN is set correctly") from e
     
-    if primary_cal:
-        calendar_id = primary_cal['id']
-        print(f"\n=== Using primary calendar: {primary_cal.get('summary', 'Unnamed')} ({calendar_id}) ===")
-    else:
-        # Fallback to first calendar if no primary found
-        calendar_id = calendars[0]['id']
-        print(f"\n=== Using calendar: {calendars[0].get('summary', 'Unnamed')} ({calendar_id}) ===")
+    # Create the Calendar API client; execute() swaps in a connection per attempt
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=ATTEMPT_TIMEOUT))
+    return build('calendar', 'v3', http=http)
+
+
+def time_range(now):
+    """Time range: today to 30 days from now"""
+    time_min = now.isoformat() + 'Z'
+    time_max = (now + timedelta(days=30)).isoformat() + 'Z'
+    return time_min, time_max
+
+
+def keep_cached(reason):
+    """Leave calendar.json and calendar-data.js from the last good run in place."""
+    print(f"\n✗ {reason}")
+    print("  Keeping cached calendar.json and calendar-data.js")
+
+
+def main():
+    try:
+        service = get_service()
+    except FetchError as e:
+        keep_cached(e)
+        return
+    except CalendarError as e:
+        print(f"Error: {e}")
+        exit(1)
     
-except Exception as e:
-    print(f"Error listing calendars: {e}")
-    import traceback
-    traceback.print_exc()
-    exit(1)
-
-# Time range: today to 30 days from now
-now = datetime.utcnow()
-time_min = now.isoformat() + 'Z'
-time_max = (now + timedelta(days=30)).isoformat() + 'Z'
-
-print(f"\n=== Fetching events ===")
-print(f"Time range: {time_min} to {time_max}")
-
-try:
-    # Fetch events
-    events_result = service.events().list(
-        calendarId=calendar_id,
-        timeMin=time_min,
-        timeMax=time_max,
-        singleEvents=True,
-        orderBy='startTime',
-        maxResults=50
-    ).execute()
+    # Try to get calendar list to see what calendars are accessible
+    print("\n=== Available calendars ===")
+    try:
+        calendar_list = execute(service.calendarList().list())
+        calendars = calendar_list.get('items', [])
+        
+        if not calendars:
+            print("ERROR: No calendars found!")
+            print("This usually means the GOOGLE_CALENDAR_REFRESH_TOKEN is invalid or expired.")
+            print("Run: python3 scripts/get_oauth_token.py")
+            # Create empty calendar.json and exit
+            with open(CALENDAR_FILE, 'w') as f:
+                json.dump({'updated': datetime.utcnow().isoformat(), 'events': []}, f)
+            exit(1)
+        else:
+            for i, cal in enumerate(calendars):
+                print(f"{i+1}. {cal.get('summary', 'Unnamed')} ({cal['id']})")
+                print(f"   Primary: {cal.get('primary', False)}")
+        
+        # Use the calendars from GOOGLE_CALENDAR_IDS, or the primary calendar (your main calendar)
+        selected_calendars = select_calendars(calendars, CALENDAR_IDS)
+        if not selected_calendars:
+            print("\nERROR: None of the calendars in GOOGLE_CALENDAR_IDS are accessible")
+            exit(1)
+        
+        print(f"\n=== Using {len(selected_calendars)} calendar(s) ===")
+        for cal in selected_calendars:
+            print(f"  - {cal.get('summary', 'Unnamed')} ({cal['id']})")
+        
+    except FetchError as e:
+        keep_cached(e)
+        return
+    except Exception as e:
+        print(f"Error listing calendars: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
     
-    events = events_result.get('items', [])
-    print(f"Found {len(events)} events")
+    now = datetime.utcnow()
+    time_min, time_max = time_range(now)
     
-    # Process events into a simpler format
-    calendar_data = {
-        'updated': now.isoformat(),
-        'events': []
-    }
+    print(f"\n=== Fetching events ===")
+    print(f"Time range: {time_min} to {time_max}")
     
-    for event in events:
-        start = event['start'].get('dateTime') or event['start'].get('date')
-        end = event['end'].get('dateTime') or event['end'].get('date')
+    try:
+        # Fetch events for every selected calendar in a single batch request
+        events_per_calendar = fetch_events_batched(service, selected_calendars, time_min, time_max)
+        for cal, events in zip(selected_calendars, events_per_calendar):
+            if events is not None:
+                print(f"Found {len(events)} events in {cal.get('summary', cal['id'])}")
         
-        event_obj = {
-            'title': event.get('summary', 'Untitled'),
-            'start': start,
-            'end': end,
-            'description': event.get('description', ''),
-            'location': event.get('location', ''),
-            'all_day': 'dateTime' not in event['start']
+        # Process events into a simpler format, merged by start time
+        calendar_data = {
+            'updated': now.isoformat(),
+            # Lets render_tenants resolve tenants' calendar names without listing them again
+            'calendars': [
+                {'id': cal['id'], 'summary': cal.get('summary', cal['id']), 'primary': cal.get('primary', False)}
+                for cal in selected_calendars
+            ],
+            'events': merge_events(selected_calendars, events_per_calendar, cached_events())
         }
         
-        calendar_data['events'].append(event_obj)
-        print(f"  - {event_obj['title']} ({start})")
-    
-    # Ensure output directory exists
-    os.makedirs('public', exist_ok=True)
-    
-    # Write to JSON file at root for GitHub Pages
-    with open('calendar.json', 'w') as f:
-        json.dump(calendar_data, f, indent=2)
-    
-    # Also write as JavaScript file for better browser compatibility
-    # This way TRMNL can load it as a simple script tag
-    with open('calendar-data.js', 'w') as f:
-        f.write('window.calendarData = ')
-        f.write(json.dumps(calendar_data))
-        f.write(';')
-    
-    print(f"\n✓ Successfully saved {len(events)} events to calendar.json and calendar-data.js")
-    
-except Exception as e:
-    print(f"\n✗ Error fetching calendar: {e}")
-    import traceback
-    traceback.print_exc()
-    exit(1)
+        for event_obj in calendar_data['events']:
+            print(f"  - {event_obj['title']} ({event_obj['start']}) [{event_obj['calendar']}]")
+        
+        # Ensure output directory exists
+        os.makedirs('public', exist_ok=True)
+        
+        # Write to JSON file at root for GitHub Pages
+        with open(CALENDAR_FILE, 'w') as f:
+            json.dump(calendar_data, f, indent=2)
+        
+        # Also write as JavaScript file for better browser compatibility
+        # This way TRMNL can load it as a simple script tag
+        with open('calendar-data.js', 'w') as f:
+            f.write('window.calendarData = ')
+            f.write(json.dumps(calendar_data))
+            f.write(';')
+        
+        print(f"\n✓ Successfully saved {len(calendar_data['events'])} events to calendar.json and calendar-data.js")
+        
+    except FetchError as e:
+        keep_cached(e)
+    except Exception as e:
+        print(f"\n✗ Error fetching calendar: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
 
 
+if __name__ == '__main__':
+    main()
@@ -3,233 +3,458 @@
 Fetch departures from Danshøj station and save to JSON.
 Uses the Rejseplanen web interface with two different URLs.
 Fetches up to 8 departures, using prognosis time if available.
+Columns are identified per page from the header and cell classes; the layout signature is
+saved with the departures and a GitHub Actions warning is raised when it changes.
 """
 
+import hashlib
 import json
 import re
 from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import quote
 
-def fetch_train_departures():
-    """Fetch next 8 departures from both trains and buses, combining results."""
-    try:
-        import requests
-        from bs4 import BeautifulSoup
+from departure_history import DepartureHistory
+from fetcher import get_fetcher
+from generate_plugin_payload import read_js_data
+
+TRAINS_FILE = Path(__file__).parent.parent / 'trains-data.js'
+
+BOARDS = [
+    {
+        'label': 'Trains (Danshøj St.)',
+        'input': 'Danshøj St.#8600742',
+        'direction': 'København H#8600626'
+    },
+    {
+        'label': 'Buses (Maribovej)',
+        'input': 'Maribovej (Vigerslevvej)#7157'
+    }
+]
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+
+def board_key(board):
+    """Identity of a station board, used to share one fetch between dashboards."""
+    return (board['input'], board.get('direction', ''))
+
+
+def build_board_url(board, target_dt):
+    """Rejseplanen station board URL for a board at the given time (latin-1 encoded input)."""
+    today = target_dt.strftime('%d.%m.%Y')
+    current_time = target_dt.strftime('%H:%M')
+    station = quote(board['input'], safe='()', encoding='latin-1')
+    direction = ''
+    if board.get('direction'):
+        direction = f"&dirInput={quote(board['direction'], safe='()', encoding='latin-1')}"
+    return (
+        'https://webapp.rejseplanen.dk/bin/stboard.exe/mn?L=vs_rp4.vs_dsb&ml=m&L=vs_rp4.vs_dsb&protocol=https:&ml=m'
+        f'&boardType=dep&input={station}{direction}&productsFilter=111111111111&maxStops=0&maxJourneys=7'
+        f'&selectDate=period&dateBegin={today}&dateEnd={today}&time={current_time}'
+        '&currentSqResultsContentType=STATIONBOARD&start=yes&'
+    )
+
+
+# Header words (lowercase prefixes) and cell classes that identify each column
+HEADER_WORDS = {
+    'time': ['kl', 'tid', 'afg'],
+    'prognosis': ['prognose', 'forventet', 'ny tid'],
+    'line': ['med', 'linje', 'tog', 'produkt'],
+    'destination': ['mod', 'retning', 'til', 'destination']
+}
+CELL_CLASSES = {
+    'line': 'sqProd',
+    'destination': 'sqResultsTerminal'
+}
+
+
+def read_header(rows):
+    """Columns named by the header row of the departures table, plus the header's width."""
+    table = rows[0].find_parent('table')
+    header_row = next((tr for tr in table.find_all('tr') if tr.find('th')), None) if table else None
+    columns = {}
+    position = 0
+    if header_row:
+        # Expand colspans so indices line up with the data cells
+        for th in header_row.find_all('th'):
+            text = th.get_text(strip=True).lower()
+            for column, words in HEADER_WORDS.items():
+                if column not in columns and any(text.startswith(word) for word in words):
+                    columns[column] = position
+            position += int(th.get('colspan', 1) or 1)
+    return columns, position
+
+
+def column_map(cells, header, header_width):
+    """Column map for one row shape: cell classes, then the header, then historical positions."""
+    columns = {}
+    sources = {}
+    
+    for index, cell in enumerate(cells):
+        classes = cell.get('class') or []
+        for column, class_name in CELL_CLASSES.items():
+            if class_name in classes:
+                columns[column] = index
+                sources[column] = 'class'
+    
+    if header_width == len(cells):
+        for column, index in header.items():
+            if column not in columns and index not in columns.values():
+                columns[column] = index
+                sources[column] = 'header'
+    
+    # Anything still unknown: the positions the board has used historically, by cell count
+    # 3 cells [time][line][destination], 4 cells [time][prognosis][line][destination],
+    # 6+ cells [time][prognosis][line][...][destination]
+    legacy = {
+        3: {'time': 0, 'line': 1, 'destination': 2},
+        4: {'time': 0, 'prognosis': 1, 'line': 2, 'destination': 3}
+    }.get(len(cells), {'time': 0, 'prognosis': 1, 'line': 2, 'destination': 5})
+    
+    # A class can claim the cell the time used to be in; then the time is the first free
+    # cell that reads HH:MM
+    if 'time' not in columns and legacy['time'] in columns.values():
+        for index, cell in enumerate(cells):
+            if index not in columns.values() and re.fullmatch(r'\d{1,2}:\d{2}', cell.get_text(strip=True)):
+                columns['time'] = index
+                sources['time'] = 'content'
+                break
+    
+    for column, index in legacy.items():
+        if column not in columns and index not in columns.values():
+            columns[column] = index
+            sources[column] = 'position'
+    
+    # Shape description for drift detection: the order and source of the columns found by
+    # class, header or content, without indices. Bus boards switch between the 3 and 4 cell
+    # layouts depending on whether any prognosis is shown, which only shifts indices, so
+    # both count as one shape.
+    found = sorted((index, column) for column, index in columns.items() if sources[column] != 'position')
+    parts = ['>'.join(f"{column}:{sources[column]}" for _, column in found)] if found else []
+    if 'position' in sources.values():
+        if len(cells) in (3, 4):
+            parts.append('positional-bus')
+        elif len(cells) >= 6:
+            parts.append('positional-train')
+        else:
+            parts.append(f"positional-{len(cells)}")
+    return columns, ','.join(parts)
+
+
+def detect_layout(rows):
+    """Work out which column holds what, once per page and row shape (cell count).
+    
+    Returns a column map per cell count and a report with the layout signature that the
+    next run compares against.
+    """
+    header, header_width = read_header(rows)
+    maps = {}
+    shapes = set()
+    for row in rows:
+        cells = row.find_all('td')
+        if len(cells) < 3 or len(cells) in maps:
+            continue
+        maps[len(cells)], shape = column_map(cells, header, header_width)
+        shapes.add(shape)
+    
+    layout = ' '.join(sorted(shapes))
+    signature = hashlib.sha1(layout.encode('utf-8')).hexdigest()[:8]
+    return maps, {'signature': signature, 'layout': layout}
+
+
+def parse_row(cells, maps):
+    """Turn one row into (scheduled, prognosis, line, destination) or raise ValueError(reason)."""
+    columns = maps.get(len(cells))
+    if columns is None:
+        raise ValueError('short row')
+    if 'time' not in columns:
+        raise ValueError('no time column')
+    if len(cells) <= max(columns.values()):
+        raise ValueError('short row')
+    
+    time_str = cells[columns['time']].get_text(strip=True)
+    if ':' not in time_str:
+        raise ValueError('no time')
+    
+    prognosis_time = None
+    if 'prognosis' in columns:
+        # Look for time in format "ca. HH:MM" or just "HH:MM"
+        time_match = re.search(r'(\d{1,2}:\d{2})', cells[columns['prognosis']].get_text(strip=True))
+        if time_match:
+            prognosis_time = time_match.group(1)
+    
+    if 'line' not in columns:
+        raise ValueError('no line column')
+    line_cell_text = cells[columns['line']].get_text(strip=True)
+    
+    # Extract line: For buses "Bus 10", for trains "B", "A", etc.
+    bus_match = re.search(r'Bus\s+(\d+)', line_cell_text)
+    train_match = re.search(r'^([A-H]x?)', line_cell_text)
+    if bus_match:
+        line = bus_match.group(1)  # Extract number for buses
+    elif train_match:
+        line = train_match.group(1)
+    else:
+        raise ValueError('unknown line')
+    
+    if 'destination' not in columns:
+        raise ValueError('no destination column')
+    # Extract the first part before "Se alle stop" or similar
+    destination = cells[columns['destination']].get_text(strip=True).split('-')[0].strip()
+    if not destination or destination in ['Unknown', 'Kl', 'Afg']:
+        raise ValueError('no destination')
+    
+    return time_str, prognosis_time, line, destination
+
+
+def parse_departures(html, url_type):
+    """Extract departures from a station board page, with a report of what was parsed."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    
+    # Find all departure rows with sqToggleDetails class
+    rows = soup.find_all('tr', class_=lambda x: x and 'sqToggleDetails' in x)
+    
+    print(f"  Found {len(rows)} departure rows")
+    
+    departures = []
+    report = {'rows': len(rows), 'parsed': 0, 'rejected': {}}
+    if not rows:
+        return departures, report
+    
+    maps, layout = detect_layout(rows)
+    report.update(layout)
+    
+    for row in rows:
+        try:
+            time_str, prognosis_time, line, destination = parse_row(row.find_all('td'), maps)
+        except ValueError as e:
+            reason = str(e)
+            report['rejected'][reason] = report['rejected'].get(reason, 0) + 1
+            continue
         
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        # Use prognosis time if available, otherwise scheduled time
+        departures.append({
+            'time': prognosis_time if prognosis_time else time_str,
+            'scheduled': time_str,
+            'destination': destination,
+            'line': line,
+            'is_realtime': prognosis_time is not None,
+            'url_source': url_type
+        })
+    
+    report['parsed'] = len(departures)
+    rejected = sum(report['rejected'].values())
+    reasons = f" {report['rejected']}" if rejected else ''
+    print(f"  Parsed {report['parsed']} rows, rejected {rejected}{reasons} [{layout['layout']}]")
+    return departures, report
+
+
+def check_layout(label, report, previous_layouts):
+    """Warn (as a GitHub Actions annotation) when a board's layout drifts or nothing parses."""
+    previous = previous_layouts.get(label, {})
+    alerts = []
+    if previous.get('signature') and report.get('signature') and previous['signature'] != report['signature']:
+        alerts.append(f"layout changed from [{previous.get('layout')}] to [{report.get('layout')}]")
+    if report['rows'] and not report['parsed']:
+        alerts.append(f"all {report['rows']} rows rejected {report['rejected']}")
+    for alert in alerts:
+        print(f"::warning title=Rejseplanen schema drift::{label}: {alert}")
+    return bool(alerts)
+
+
+def fetch_board(board, target_dt):
+    """Fetch and parse one station board, returning its departures and parse report."""
+    response = get_fetcher().get(build_board_url(board, target_dt), headers=HEADERS)
+    departures, report = parse_departures(response.text, board['label'])
+    for dep in departures:
+        dep['stop'] = board['input'].split('#')[0]
+    return departures, report
+
+
+def cached_departures(label, now=None):
+    """Departures for a board from the previous trains-data.js that haven't left yet."""
+    now = now or datetime.now()
+    now_minutes = now.hour * 60 + now.minute
+    
+    trains_data = read_js_data(TRAINS_FILE, 'trainsData')
+    # The board's full list if saved, else its share of the combined departures
+    previous = trains_data.get('boards', {}).get(label, trains_data.get('departures', []))
+    upcoming = []
+    for dep in previous:
+        if dep.get('url_source') != label:
+            continue
+        try:
+            hours, minutes = map(int, dep['time'].split(':'))
+        except (KeyError, ValueError):
+            continue
+        # Minutes until departure, wrapping past midnight; anything "12h away" has already left
+        if (hours * 60 + minutes - now_minutes) % (24 * 60) < 12 * 60:
+            upcoming.append(dep)
+    return upcoming
+
+
+def combine_departures(departures, limit=8):
+    """Sort departures from several boards by time and keep the nearest ones."""
+    # Parse times for sorting (HH:MM format)
+    def parse_time(departure):
+        try:
+            hours, minutes = map(int, departure['time'].split(':'))
+            return hours * 60 + minutes
+        except:
+            return 9999
+    
+    return sorted(departures, key=parse_time)[:limit]
+
+
+def target_time():
+    """Boards are requested from now plus 15 minutes (handles day roll-over)."""
+    return datetime.now() + timedelta(minutes=15)
+
+
+def mock_departures():
+    """Fallback departures used when no board could be fetched."""
+    now = datetime.now()
+    departures = [
+        {
+            'time': (now + timedelta(minutes=7)).strftime('%H:%M'),
+            'destination': 'Ryparken St.',
+            'line': 'F',
+            'is_realtime': False
+        },
+        {
+            'time': (now + timedelta(minutes=12)).strftime('%H:%M'),
+            'destination': 'Farum St.',
+            'line': 'B',
+            'is_realtime': False
+        },
+        {
+            'time': (now + timedelta(minutes=18)).strftime('%H:%M'),
+            'destination': 'København Syd St.',
+            'line': 'F',
+            'is_realtime': False
+        },
+        {
+            'time': (now + timedelta(minutes=25)).strftime('%H:%M'),
+            'destination': 'Høje Taastrup St.',
+            'line': 'B',
+            'is_realtime': False
+        },
+        {
+            'time': (now + timedelta(minutes=32)).strftime('%H:%M'),
+            'destination': 'Køge St.',
+            'line': 'E',
+            'is_realtime': False
+        },
+        {
+            'time': (now + timedelta(minutes=37)).strftime('%H:%M'),
+            'destination': 'Ballerup St.',
+            'line': 'A',
+            'is_realtime': False
+        },
+        {
+            'time': (now + timedelta(minutes=42)).strftime('%H:%M'),
+            'destination': 'Lyngby St.',
+            'line': 'C',
+            'is_realtime': False
+        },
+        {
+            'time': (now + timedelta(minutes=48)).strftime('%H:%M'),
+            'destination': 'Hillerød St.',
+            'line': 'H',
+            'is_realtime': False
         }
-        
-        # Build URLs with current date and time plus 15 minutes (handles day roll-over)
-        target_dt = datetime.now() + timedelta(minutes=15)
-        today = target_dt.strftime('%d.%m.%Y')
-        current_time = target_dt.strftime('%H:%M')
-        
-        # URL 1: Trains from Danshøj
-        url1 = f'https://webapp.rejseplanen.dk/bin/stboard.exe/mn?L=vs_rp4.vs_dsb&ml=m&L=vs_rp4.vs_dsb&protocol=https:&ml=m&boardType=dep&input=Dansh%F8j%20St.%238600742&dirInput=K%F8benhavn%20H%238600626&productsFilter=111111111111&maxStops=0&maxJourneys=7&selectDate=period&dateBegin={today}&dateEnd={today}&time={current_time}&currentSqResultsContentType=STATIONBOARD&start=yes&'
-        
-        # URL 2: Buses from Maribovej
-        url2 = f'https://webapp.rejseplanen.dk/bin/stboard.exe/mn?L=vs_rp4.vs_dsb&ml=m&L=vs_rp4.vs_dsb&protocol=https:&ml=m&boardType=dep&input=Maribovej%20(Vigerslevvej)%237157&productsFilter=111111111111&maxStops=0&maxJourneys=7&selectDate=period&dateBegin={today}&dateEnd={today}&time={current_time}&currentSqResultsContentType=STATIONBOARD&start=yes&'
-        
-        urls_to_try = [
-            (url1, "Trains (Danshøj St.)"),
-            (url2, "Buses (Maribovej)")
-        ]
-        
+    ]
+    return departures
+
+
+def record_history(departures):
+    """Append scraped departures to history/; a broken store never costs the board its data."""
+    try:
+        print(f"  Recorded {DepartureHistory().append(departures)} observations in history/")
+    except Exception as e:
+        print(f"  ✗ Could not record history: {e}")
+
+
+def fetch_train_departures(boards=BOARDS):
+    """Fetch next 8 departures from both trains and buses, combining results.
+    
+    Also returns the per-board layout reports, which are saved with the departures so the
+    next run can detect schema drift, and each board's full departure list by label, which
+    render_tenants reuses for dashboards showing only some of the boards.
+    """
+    previous_layouts = read_js_data(TRAINS_FILE, 'trainsData').get('layouts', {})
+    layouts = {}
+    board_lists = {}
+    try:
+        target_dt = target_time()
         departures = []
+        observed = []
         
-        for url, url_type in urls_to_try:
+        for board in boards:
             try:
-                print(f"Fetching {url_type}...")
-                response = requests.get(url, headers=headers, timeout=10)
-                response.raise_for_status()
-                
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Find all departure rows with sqToggleDetails class
-                rows = soup.find_all('tr', class_=lambda x: x and 'sqToggleDetails' in x)
-                
-                print(f"  Found {len(rows)} departure rows")
-                
-                for row in rows:
-                    try:
-                        cells = row.find_all('td')
-                        if len(cells) < 3:
-                            continue
-                        
-                        # Determine if this is a bus or train based on cell count
-                        # Bus format: 3 cells [time][line][destination] or 4 cells [time][prognosis][line][destination]
-                        # Train format: 6+ cells [time][prognosis][line][...][destination]
-                        
-                        is_bus = len(cells) in [3, 4]
-                        
-                        # Cell 0: scheduled time
-                        time_str = cells[0].get_text(strip=True)
-                        if ':' not in time_str:
-                            continue
-                        
-                        prognosis_time = None
-                        
-                        if is_bus:
-                            if len(cells) == 3:
-                                # Bus: [time][line][destination]
-                                line_cell_text = cells[1].get_text(strip=True)
-                                destination_text = cells[2].get_text(strip=True)
-                            else:  # len(cells) == 4
-                                # Bus: [time][prognosis][line][destination]
-                                prognosis_text = cells[1].get_text(strip=True)
-                                # Look for time in format "ca. HH:MM" or just "HH:MM"
-                                time_match = re.search(r'(\d{1,2}:\d{2})', prognosis_text)
-                                if time_match:
-                                    prognosis_time = time_match.group(1)
-                                
-                                line_cell_text = cells[2].get_text(strip=True)
-                                destination_text = cells[3].get_text(strip=True)
-                        else:
-                            # Train format (6+ cells): [time][prognosis][line][...][destination]
-                            # Cell 1: prognosis time (may be empty)
-                            if len(cells) > 1:
-                                prognosis_text = cells[1].get_text(strip=True)
-                                # Look for time in format "ca. HH:MM" or just "HH:MM"
-                                time_match = re.search(r'(\d{1,2}:\d{2})', prognosis_text)
-                                if time_match:
-                                    prognosis_time = time_match.group(1)
-                            
-                            # Cell 2 (sqProd): line/product
-                            line_cell_text = cells[2].get_text(strip=True)
-                            
-                            # Cell 5 (sqResultsTerminal): destination
-                            destination_text = cells[5].get_text(strip=True) if len(cells) >= 6 else 'Unknown'
-                        
-                        # Use prognosis time if available, otherwise scheduled time
-                        display_time = prognosis_time if prognosis_time else time_str
-                        
-                        # Extract line: For buses "Bus 10", for trains "B", "A", etc.
-                        bus_match = re.search(r'Bus\s+(\d+)', line_cell_text)
-                        if bus_match:
-                            line = bus_match.group(1)  # Extract number for buses
-                        else:
-                            # For trains, extract letter(s)
-                            train_match = re.search(r'^([A-H]x?)', line_cell_text)
-                            if train_match:
-                                line = train_match.group(1)
-                            else:
-                                continue
-                        
-                        # Extract the first part before "Se alle stop" or similar
-                        destination = destination_text.split('-')[0].strip()
-                        
-                        # Skip if no valid destination
-                        if not destination or destination in ['Unknown', 'Kl', 'Afg']:
-                            continue
-                        
-                        departures.append({
-                            'time': display_time,
-                            'destination': destination,
-                            'line': line,
-                            'is_realtime': prognosis_time is not None,
-                            'url_source': url_type
-                        })
-                        
-                    except Exception as e:
-                        continue
-                    
+                print(f"Fetching {board['label']}...")
+                board_departures, report = fetch_board(board, target_dt)
+                check_layout(board['label'], report, previous_layouts)
+                departures.extend(board_departures)
+                layouts[board['label']] = report
+                board_lists[board['label']] = board_departures
+                observed.extend(board_departures)
             except Exception as e:
-                print(f"  ✗ {url_type} failed: {e}")
+                print(f"  ✗ {board['label']} failed: {e}")
+                if board['label'] in previous_layouts:
+                    layouts[board['label']] = previous_layouts[board['label']]
+                cached = cached_departures(board['label'])
+                if cached:
+                    print(f"  Using {len(cached)} cached departures")
+                    departures.extend(cached)
+                board_lists[board['label']] = cached
                 continue
         
+        # Keep every freshly scraped departure (not cached ones) for delay statistics
+        if observed:
+            record_history(observed)
+        
         # Sort departures by time and take the first 8
         if departures:
-            # Parse times for sorting (HH:MM format)
-            def parse_time(departure):
-                try:
-                    hours, minutes = map(int, departure['time'].split(':'))
-                    return hours * 60 + minutes
-                except:
-                    return 9999
+            departures = combine_departures(departures)
             
-            departures.sort(key=parse_time)
-            departures = departures[:8]
-            
-            print(f"\n✓ Combined results from both sources")
+            print(f"\n✓ Combined results from {len(boards)} sources")
             print(f"✓ Showing {len(departures)} nearest departures:")
             for dep in departures:
                 realtime_indicator = " (realtime)" if dep['is_realtime'] else ""
                 print(f"  - {dep['time']}: Line {dep['line']} → {dep['destination']} [{dep['url_source']}]{realtime_indicator}")
-            return departures
+            return departures, layouts, board_lists
         
-        # If we got here, both URLs failed
-        raise Exception("Both URLs failed to fetch departures")
+        # If we got here, every board failed
+        raise Exception("All boards failed to fetch departures")
         
     except Exception as e:
         print(f"✗ Error fetching trains from Rejseplanen: {e}")
         print("  Using fallback mock data")
         
-        # Fallback: Use mock data
-        now = datetime.now()
-        mock_departures = [
-            {
-                'time': (now + timedelta(minutes=7)).strftime('%H:%M'),
-                'destination': 'Ryparken St.',
-                'line': 'F',
-                'is_realtime': False
-            },
-            {
-                'time': (now + timedelta(minutes=12)).strftime('%H:%M'),
-                'destination': 'Farum St.',
-                'line': 'B',
-                'is_realtime': False
-            },
-            {
-                'time': (now + timedelta(minutes=18)).strftime('%H:%M'),
-                'destination': 'København Syd St.',
-                'line': 'F',
-                'is_realtime': False
-            },
-            {
-                'time': (now + timedelta(minutes=25)).strftime('%H:%M'),
-                'destination': 'Høje Taastrup St.',
-                'line': 'B',
-                'is_realtime': False
-            },
-            {
-                'time': (now + timedelta(minutes=32)).strftime('%H:%M'),
-                'destination': 'Køge St.',
-                'line': 'E',
-                'is_realtime': False
-            },
-            {
-                'time': (now + timedelta(minutes=37)).strftime('%H:%M'),
-                'destination': 'Ballerup St.',
-                'line': 'A',
-                'is_realtime': False
-            },
-            {
-                'time': (now + timedelta(minutes=42)).strftime('%H:%M'),
-                'destination': 'Lyngby St.',
-                'line': 'C',
-                'is_realtime': False
-            },
-            {
-                'time': (now + timedelta(minutes=48)).strftime('%H:%M'),
-                'destination': 'Hillerød St.',
-                'line': 'H',
-                'is_realtime': False
-            }
-        ]
-        print(f"  Using {len(mock_departures)} mock departures")
-        return mock_departures
+        departures = mock_departures()
+        print(f"  Using {len(departures)} mock departures")
+        return departures, layouts or previous_layouts, {}
+
 
 if __name__ == '__main__':
-    departures = fetch_train_departures()
+    departures, layouts, board_lists = fetch_train_departures()
     
     # Save to trains-data.js
     train_data = {
         'updated': datetime.now().isoformat(),
         'station': 'Danshøj / Maribovej',
-        'departures': departures
+        'departures': departures,
+        'layouts': layouts,
+        'boards': board_lists
     }
     
-    with open('trains-data.js', 'w') as f:
+    with open(TRAINS_FILE, 'w') as f:
         f.write('window.trainsData = ')
         f.write(json.dumps(train_data))
         f.write(';')
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Fetch the met.no forecast for Valby and save the displayed values to JSON.
+Mirrors what index.html computes in the browser (today, rain next 12h, next 3 days)
+so the TRMNL polling payload can carry the weather without a client-side fetch.
+"""
+
+import json
+import os
+from datetime import datetime
+
+from fetcher import get_fetcher
+
+COPENHAGEN_LAT = 55.7186
+COPENHAGEN_LON = 12.4861
+USER_AGENT = 'TRMNL-Weather (valby-copenhagen) https://github.com/ldalboel/trmnlweather'
+
+# Points in the same 0.01° cell (~1 km) share one forecast fetch
+GRID_DECIMALS = 2
+
+
+def grid_key(lat, lon):
+    """Round a location to the forecast grid so nearby dashboards share one fetch."""
+    return (round(lat, GRID_DECIMALS), round(lon, GRID_DECIMALS))
+
+
+def summarize_forecast(data, now=None):
+    """Reduce a met.no locationforecast response to the values shown on the page."""
+    now = now or datetime.now().astimezone()
+    timeseries = data['properties']['timeseries']
+
+    entries = []
+    for entry in timeseries:
+        entry_time = datetime.fromisoformat(entry['time'].replace('Z', '+00:00')).astimezone(now.tzinfo)
+        next_hour = entry['data'].get('next_1_hours', {})
+        entries.append({
+            'time': entry_time,
+            'temp': entry['data']['instant']['details']['air_temperature'],
+            'wind': entry['data']['instant']['details'].get('wind_speed', 0),
+            'symbol': next_hour.get('summary', {}).get('symbol_code', 'unknown'),
+            'precip': next_hour.get('details', {}).get('precipitation_amount', 0) or 0
+        })
+
+    # Group by local day, same as the page does
+    days = {}
+    for entry in entries:
+        days.setdefault(entry['time'].date(), []).append(entry)
+
+    current = entries[0]
+    today = days.get(now.date(), [])
+    today_temps = [e['temp'] for e in today] or [current['temp']]
+
+    daily = []
+    for day in sorted(days)[1:4]:
+        day_entries = days[day]
+        temps = [e['temp'] for e in day_entries]
+        daily.append({
+            'day': day.strftime('%a').upper(),
+            'high': round(max(temps)),
+            'low': round(min(temps)),
+            'symbol': day_entries[len(day_entries) // 2]['symbol'],
+            'precip': round(sum(e['precip'] for e in day_entries), 1)
+        })
+
+    return {
+        'current': {
+            'temp': round(current['temp']),
+            'symbol': current['symbol'],
+            'wind': round(current['wind']),
+            'high': round(max(today_temps)),
+            'low': round(min(today_temps)),
+            'precip': round(sum(e['precip'] for e in today), 1)
+        },
+        'hourly': [
+            {'hour': e['time'].strftime('%H'), 'precip': round(e['precip'], 1)}
+            for e in entries[:12]
+        ],
+        'daily': daily
+    }
+
+
+def fetch_weather(lat=COPENHAGEN_LAT, lon=COPENHAGEN_LON):
+    """Fetch the compact locationforecast for a point and summarize it."""
+    url = f'https://api.met.no/weatherapi/locationforecast/2.0/compact?lat={lat}&lon={lon}'
+    response = get_fetcher().get(url, headers={'User-Agent': USER_AGENT})
+    return summarize_forecast(response.json())
+
+
+if __name__ == '__main__':
+    try:
+        weather = fetch_weather()
+    except Exception as e:
+        print(f"✗ Error fetching weather from met.no: {e}")
+        # Keep the previous weather-data.js if there is one, the page still fetches live
+        if os.path.exists('weather-data.js'):
+            exit(0)
+        weather = {}
+
+    weather_data = {
+        'updated': datetime.now().isoformat(),
+        'location': 'Copenhagen',
+        **weather
+    }
+
+    with open('weather-data.js', 'w') as f:
+        f.write('window.weatherData = ')
+        f.write(json.dumps(weather_data))
+        f.write(';')
+
+    print(f"✓ Saved weather data to weather-data.js")
+    if weather:
+        print(f"  - Now: {weather['current']['temp']}°C, {weather['current']['symbol']}")
@@ -0,0 +1,102 @@
+"""Round trips through the columnar store in departure_history.py."""
+
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'scripts'))
+
+import departure_history  # noqa: E402
+from departure_history import DepartureHistory  # noqa: E402
+
+OBSERVED_AT = datetime(2026, 10, 19, 7, 50, tzinfo=timezone(timedelta(hours=2)))
+
+
+def departure(line, scheduled, time=None, stop='Danshøj St.'):
+    return {'line': line, 'scheduled': scheduled, 'time': time or scheduled, 'stop': stop,
+            'is_realtime': time is not None}
+
+
+@pytest.fixture
+def history(tmp_path):
+    return DepartureHistory(tmp_path / 'history')
+
+
+def test_append_and_query_round_trip(history):
+    assert history.append([
+        departure('B', '08:04', '08:07'),
+        departure('Bx', '08:14'),
+        departure('10', '09:01', stop='Maribovej'),
+        {'line': 'B'},  # no time, skipped
+    ], OBSERVED_AT) == 3
+
+    reopened = DepartureHistory(history.path)
+    assert len(reopened) == 3
+    assert reopened.select(line='B') == [0]
+    assert reopened.select(stop='Maribovej') == [2]
+    assert reopened.select(hours=[8]) == [0, 1]
+    assert reopened.select(line='C') == []
+    assert reopened.select(since=OBSERVED_AT + timedelta(hours=1)) == [2]
+
+    stats = reopened.delay_stats(hours=[8])
+    assert stats['departures'] == 2
+    assert stats['max'] == 3
+    assert stats['realtime'] == 1
+
+
+def test_delay_stats_keeps_only_the_last_observation(history):
+    history.append([departure('B', '08:04', '08:06')], OBSERVED_AT)
+    history.append([departure('B', '08:04', '08:09')], OBSERVED_AT + timedelta(minutes=3))
+
+    stats = history.delay_stats(line='B')
+    assert stats['observations'] == 2
+    assert stats['departures'] == 1
+    assert stats['mean'] == 5
+
+
+def test_interrupted_append_is_trimmed(history):
+    history.append([departure('B', '08:04')], OBSERVED_AT)
+    # A run that died after writing only some columns leaves uneven lengths
+    with open(history._column_file('sched'), 'ab') as f:
+        f.write(b'\x01\x02\x03\x04')
+    with open(history._column_file('delay'), 'ab') as f:
+        f.write(b'\x05\x06')
+    assert len(history) == 1
+
+    history.append([departure('C', '08:10')], OBSERVED_AT)
+    sizes = {name: history._column_file(name).stat().st_size // departure_history.array(typecode).itemsize
+             for name, typecode in departure_history.COLUMNS.items()}
+    assert set(sizes.values()) == {2}
+    assert history.select(line='C') == [1]
+
+
+def test_select_skips_blocks_by_line_and_hour(history, monkeypatch):
+    monkeypatch.setattr(departure_history, 'BLOCK_ROWS', 2)
+    history.append([
+        departure('B', '08:04'), departure('B', '08:14'),
+        departure('C', '17:04'), departure('C', '17:14'),
+        departure('B', '17:24'),
+    ], OBSERVED_AT)
+
+    blocks = history.index['blocks']
+    assert len(blocks) == 3
+    b, c = history.dictionary['lines'].index('B'), history.dictionary['lines'].index('C')
+    assert blocks[0] == {'lines': [b], 'hours': 1 << 8}
+    assert blocks[1] == {'lines': [c], 'hours': 1 << 17}
+
+    assert history.select(line='B') == [0, 1, 4]
+    assert history.select(line='B', hours=[17]) == [4]
+
+    # The rows are only read for blocks the index says can match
+    blocks[2]['lines'] = [c]
+    assert history.select(line='B') == [0, 1]
+    blocks[0]['hours'] = 1 << 9
+    assert history.select(hours=[8]) == []
+
+
+def test_index_uses_native_line_ids_on_big_endian_hosts(history, monkeypatch):
+    monkeypatch.setattr(departure_history.sys, 'byteorder', 'big')
+    history.append([departure('B', '08:04'), departure('C', '08:14')], OBSERVED_AT)
+    assert history.index['blocks'][0]['lines'] == [0, 1]
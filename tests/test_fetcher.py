@@ -0,0 +1,169 @@
+"""Circuit breaker and retry logic in fetcher.py, without any network."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'scripts'))
+
+import fetcher  # noqa: E402
+from fetcher import FAILURE_THRESHOLD, MAX_ATTEMPTS, CircuitBreaker, FetchError, Fetcher, is_retryable  # noqa: E402
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.response = type('Response', (), {'status_code': status})()
+
+
+class TransportError(Exception):
+    """Stand-in for google.auth.exceptions.TransportError, which wraps timeouts."""
+    retryable = False
+
+
+class RefreshError(Exception):
+    """Stand-in for google.auth.exceptions.RefreshError for a revoked token."""
+    retryable = False
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(fetcher.time, 'time', clock.time)
+    monkeypatch.setattr(fetcher.time, 'sleep', clock.sleep)
+    monkeypatch.setattr(fetcher.random, 'uniform', lambda low, high: high)
+    return clock
+
+
+@pytest.fixture
+def breaker(tmp_path):
+    return CircuitBreaker(tmp_path / 'fetch-state.json')
+
+
+def test_is_retryable():
+    assert is_retryable(TimeoutError())
+    assert is_retryable(HTTPError(429))
+    assert is_retryable(HTTPError(503))
+    assert not is_retryable(HTTPError(404))
+    assert is_retryable(TransportError())
+    assert not is_retryable(RefreshError())
+
+
+def test_failures_count_once_per_run(clock, breaker):
+    for _ in range(5):
+        breaker.record_failure('example.com', run=1)
+    assert breaker.hosts['example.com']['failures'] == 1
+    assert breaker.allow('example.com')
+
+
+def test_circuit_opens_at_threshold(clock, breaker):
+    for run in range(FAILURE_THRESHOLD - 1):
+        breaker.record_failure('example.com', run)
+    assert breaker.allow('example.com')
+
+    breaker.record_failure('example.com', FAILURE_THRESHOLD)
+    assert not breaker.allow('example.com')
+
+    breaker.save()
+    assert not CircuitBreaker(breaker.state_file).allow('example.com')
+
+
+def test_failed_half_open_trial_reopens(clock, breaker):
+    for run in range(FAILURE_THRESHOLD):
+        breaker.record_failure('example.com', run)
+    clock.now += fetcher.OPEN_SECONDS
+    assert breaker.allow('example.com')
+
+    breaker.record_failure('example.com', 'trial run')
+    assert not breaker.allow('example.com')
+    clock.now += fetcher.OPEN_SECONDS - 1
+    assert not breaker.allow('example.com')
+
+
+def test_success_closes_circuit(clock, breaker):
+    breaker.record_failure('example.com', 1)
+    breaker.record_success('example.com')
+    assert 'example.com' not in breaker.hosts
+
+
+def test_call_retries_then_succeeds(clock, breaker):
+    outcomes = [TimeoutError('slow'), HTTPError(503), 'ok']
+    timeouts = []
+
+    def fn(timeout):
+        timeouts.append(timeout)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert Fetcher(deadline=clock.now + 60, breaker=breaker).call('example.com', fn) == 'ok'
+    assert timeouts == [fetcher.ATTEMPT_TIMEOUT] * 3
+    assert breaker.hosts == {}
+
+
+def test_call_gives_up_after_max_attempts(clock, breaker):
+    calls = []
+
+    def fn(timeout):
+        calls.append(timeout)
+        raise TransportError('timed out')
+
+    with pytest.raises(FetchError):
+        Fetcher(deadline=clock.now + 60, breaker=breaker).call('example.com', fn)
+    assert len(calls) == MAX_ATTEMPTS
+    assert breaker.hosts['example.com']['failures'] == 1
+
+
+def test_call_does_not_retry_non_retryable(clock, breaker):
+    breaker.record_failure('example.com', 'earlier run')
+    calls = []
+
+    def fn(timeout):
+        calls.append(timeout)
+        raise RefreshError('invalid_grant')
+
+    with pytest.raises(RefreshError):
+        Fetcher(deadline=clock.now + 60, breaker=breaker).call('example.com', fn)
+    assert len(calls) == 1
+    # The host answered, so its failure count is cleared
+    assert 'example.com' not in breaker.hosts
+
+
+def test_call_stays_within_budget(clock, breaker):
+    timeouts = []
+
+    def fn(timeout):
+        timeouts.append(timeout)
+        clock.now += timeout
+        raise TimeoutError('slow')
+
+    with pytest.raises(FetchError):
+        Fetcher(deadline=clock.now + 5, breaker=breaker).call('example.com', fn)
+    assert timeouts == [5]
+    assert clock.now <= 1005
+
+
+def test_call_with_budget_spent_leaves_breaker_alone(clock, breaker):
+    with pytest.raises(FetchError, match='budget spent'):
+        Fetcher(deadline=clock.now, breaker=breaker).call('example.com', lambda timeout: 'never')
+    assert breaker.hosts == {}
+
+
+def test_call_skips_open_circuit(clock, breaker):
+    for run in range(FAILURE_THRESHOLD):
+        breaker.record_failure('example.com', run)
+    with pytest.raises(FetchError, match='circuit open'):
+        Fetcher(deadline=clock.now + 60, breaker=breaker).call('example.com', lambda timeout: 'never')
@@ -0,0 +1,108 @@
+"""Column detection in update_trains.parse_departures, on small station board fixtures."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'scripts'))
+
+pytest.importorskip('bs4')
+
+from update_trains import parse_departures  # noqa: E402
+
+
+def board(rows, header=None):
+    """A departures table with sqToggleDetails rows, optionally under a <th> header row."""
+    html = '<table>'
+    if header:
+        html += '<tr>' + ''.join(f'<th>{th}</th>' for th in header) + '</tr>'
+    for row in rows:
+        html += '<tr class="sqToggleDetails">' + ''.join(row) + '</tr>'
+    return html + '</table>'
+
+
+def parsed(departures):
+    return [(dep['line'], dep['scheduled'], dep['time'], dep['destination']) for dep in departures]
+
+
+def test_columns_from_cell_classes():
+    html = board([
+        ['<td>12:04</td>', '<td>ca. 12:06</td>', '<td class="sqProd">B</td>', '<td class="sqResultsTerminal">Høje Taastrup St.</td>'],
+        ['<td>12:14</td>', '<td></td>', '<td class="sqProd">Bx</td>', '<td class="sqResultsTerminal">Farum St.</td>'],
+    ])
+    departures, report = parse_departures(html, 'Trains')
+    assert parsed(departures) == [
+        ('B', '12:04', '12:06', 'Høje Taastrup St.'),
+        ('Bx', '12:14', '12:14', 'Farum St.'),
+    ]
+    assert report['parsed'] == 2 and not report['rejected']
+    assert report['layout'] == 'line:class>destination:class,positional-bus'
+
+
+def test_class_in_first_cell_does_not_hide_the_time():
+    # The line moved to the front: the legacy time position is taken by a class match
+    html = board([
+        ['<td class="sqProd">Bus 10</td>', '<td>12:07</td>', '<td class="sqResultsTerminal">Hellerup St.</td>'],
+    ])
+    departures, report = parse_departures(html, 'Buses')
+    assert parsed(departures) == [('10', '12:07', '12:07', 'Hellerup St.')]
+    assert report['layout'] == 'line:class>time:content>destination:class'
+
+
+def test_columns_from_header():
+    html = board(
+        [['<td>Bus 18</td>', '<td>12:09</td>', '<td>Rødovre St.</td>']],
+        header=['Med', 'Afg.', 'Mod']
+    )
+    departures, report = parse_departures(html, 'Buses')
+    assert parsed(departures) == [('18', '12:09', '12:09', 'Rødovre St.')]
+    assert report['layout'] == 'line:header>time:header>destination:header'
+
+
+def test_columns_from_legacy_positions():
+    html = board([
+        ['<td>12:20</td>', '<td>12:22</td>', '<td>Bus 10</td>', '<td>Valby St.</td>'],
+        ['<td>12:30</td>', '<td>Bus 10</td>', '<td>Valby St.</td>'],
+    ])
+    departures, report = parse_departures(html, 'Buses')
+    assert parsed(departures) == [
+        ('10', '12:20', '12:22', 'Valby St.'),
+        ('10', '12:30', '12:30', 'Valby St.'),
+    ]
+    assert report['layout'] == 'positional-bus'
+
+
+def test_bus_rows_with_and_without_prognosis_share_a_signature():
+    three = board([['<td>12:20</td>', '<td class="sqProd">Bus 10</td>', '<td class="sqResultsTerminal">Valby St.</td>']])
+    four = board([['<td>12:20</td>', '<td>12:22</td>', '<td class="sqProd">Bus 10</td>', '<td class="sqResultsTerminal">Valby St.</td>']])
+    _, three_report = parse_departures(three, 'Buses')
+    _, four_report = parse_departures(four, 'Buses')
+    assert three_report['layout'] == 'line:class>destination:class,positional-bus'
+    assert three_report['signature'] == four_report['signature']
+
+def test_row_without_a_time_column_is_rejected():
+    html = board([
+        ['<td class="sqProd">Bus 10</td>', '<td>soon</td>', '<td class="sqResultsTerminal">Hellerup St.</td>'],
+    ])
+    departures, report = parse_departures(html, 'Buses')
+    assert departures == []
+    assert report['rejected'] == {'no time column': 1}
+
+
+def test_broken_history_keeps_the_scraped_departures(tmp_path, monkeypatch):
+    import update_trains
+    from departure_history import DepartureHistory
+
+    departure = {'time': '12:04', 'scheduled': '12:04', 'destination': 'Farum St.', 'line': 'B',
+                 'is_realtime': False, 'url_source': 'Trains (Danshøj St.)'}
+    history = tmp_path / 'history'
+    history.mkdir()
+    (history / 'dictionary.json').write_text('{not json', encoding='utf-8')
+
+    monkeypatch.setattr(update_trains, 'TRAINS_FILE', tmp_path / 'trains-data.js')
+    monkeypatch.setattr(update_trains, 'fetch_board', lambda board, target_dt: ([dict(departure)], {'rows': 1, 'parsed': 1}))
+    monkeypatch.setattr(update_trains, 'DepartureHistory', lambda: DepartureHistory(history))
+
+    departures, _, _ = update_trains.fetch_train_departures(update_trains.BOARDS[:1])
+    assert [dep['destination'] for dep in departures] == ['Farum St.']